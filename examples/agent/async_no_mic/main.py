@@ -0,0 +1,350 @@
+# Copyright 2025 Deepgram SDK contributors. All Rights Reserved.
+# Use of this source code is governed by a MIT license that can be found in the LICENSE file.
+# SPDX-License-Identifier: MIT
+
+# asyncio version of examples/agent/no_mic: the audio upload, keep-alive and
+# event handlers all run as tasks on a single event loop instead of threads.
+import asyncio
+import aiohttp
+import collections
+import functools
+import json
+import logging
+import os
+import struct
+
+from deepgram import (
+    DeepgramClient,
+    DeepgramClientOptions,
+    AgentWebSocketEvents,
+    AgentKeepAlive,
+)
+from deepgram.clients.agent.v1.websocket.options import SettingsOptions
+
+logger = logging.getLogger(__name__)
+
+# Shared compact JSON encoder for chat log entries
+_json_encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+AUDIO_URL = "https://dpgr.am/spacewalk.wav"
+
+
+async def main():
+    connection = None
+    chatlog_fd = None
+    wav_file = None
+    chatlog_wake = asyncio.Event()
+    chatlog_stop = asyncio.Event()
+    chatlog_task = None
+    keep_alive_task = None
+    try:
+        # Initialize the Voice Agent
+        api_key = os.getenv("DEEPGRAM_API_KEY")
+        if not api_key:
+            raise ValueError("DEEPGRAM_API_KEY environment variable is not set")
+        print(f"API Key found:")
+
+        # Initialize Deepgram client
+        config = DeepgramClientOptions(
+            options={
+                "keepalive": "true",
+            },
+        )
+        deepgram = DeepgramClient(api_key, config)
+        connection = deepgram.agent.asyncwebsocket.v("1")
+        print("Created WebSocket connection...")
+
+        # Configure the Agent
+        options = SettingsOptions()
+        # Audio input configuration
+        options.audio.input.encoding = "linear16"
+        options.audio.input.sample_rate = 24000
+        # Audio output configuration
+        options.audio.output.encoding = "linear16"
+        options.audio.output.sample_rate = 24000
+        options.audio.output.container = "wav"
+        # Agent configuration
+        options.agent.language = "en"
+        options.agent.listen.provider.type = "deepgram"
+        options.agent.listen.provider.model = "nova-3"
+        options.agent.think.provider.type = "open_ai"
+        options.agent.think.provider.model = "gpt-4o-mini"
+        options.agent.think.prompt = "You are a friendly AI assistant."
+        options.agent.speak.provider.type = "deepgram"
+        options.agent.speak.provider.model = "aura-2-thalia-en"
+        options.agent.greeting = "Hello! How can I help you today?"
+
+        # Send Keep Alive messages every 5 seconds until the task is cancelled
+        keep_alive_message = str(AgentKeepAlive())
+
+        async def send_keep_alive():
+            loop = asyncio.get_running_loop()
+            next_tick = loop.time() + 5
+            while True:
+                await asyncio.sleep(max(0, next_tick - loop.time()))
+                # Skip ticks missed during a stall so it costs at most one catch-up send
+                now = loop.time()
+                while next_tick <= now:
+                    next_tick += 5
+                if not await connection.is_connected():
+                    continue
+                logger.debug("Keep alive!")
+                if not await connection.send(keep_alive_message):
+                    logger.debug("Keep alive send failed, retrying on the next tick")
+
+        # Open the chat log once in append mode. Handlers queue lines for a
+        # writer task, which hands each batch to a worker thread so disk latency
+        # never blocks the event loop. The queue drops the oldest lines on overrun.
+        chatlog_fd = os.open("chatlog.txt", os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        chatlog_queue = collections.deque(maxlen=1024)
+
+        def write_chatlog(line):
+            chatlog_queue.append(line)
+            chatlog_wake.set()
+
+        async def drain_chatlog():
+            # Coalesce everything queued so far into a single append
+            lines = []
+            while chatlog_queue:
+                lines.append(chatlog_queue.popleft())
+            if lines:
+                await asyncio.to_thread(os.write, chatlog_fd, "".join(lines).encode("utf-8"))
+
+        async def chatlog_writer():
+            while not chatlog_stop.is_set():
+                await chatlog_wake.wait()
+                chatlog_wake.clear()
+                await drain_chatlog()
+            await drain_chatlog()
+
+        # Setup Event Handlers
+        file_counter = 0
+        # processing_complete is only set by an AgentAudioDone that answers
+        # something the user said, so the greeting does not count as a reply.
+        processing_complete = asyncio.Event()
+        reply_pending = False
+
+        # Agent audio is streamed straight into output-N.wav as it arrives, so
+        # memory use stays flat however long the response is. The file is
+        # opened on the first chunk with a placeholder header whose sizes are
+        # patched in once the agent is done speaking. Chunks are written on the
+        # loop into a 1 MiB buffer, which is mostly a memcpy; opening, truncating
+        # and finishing the file run in a worker thread.
+        async def on_audio_data(self, data, **kwargs):
+            nonlocal wav_file
+            # Convert anything that isn't already a bytes-like buffer once, so
+            # the file write below always takes the buffer-protocol fast path
+            if not isinstance(data, (bytes, bytearray, memoryview)):
+                data = bytes(data)
+            if wav_file is None:
+                wav_file = await asyncio.to_thread(
+                    open, f"output-{file_counter}.wav", 'wb', buffering=1 << 20
+                )
+                wav_file.write(create_wav_header())
+            wav_file.write(data)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received audio data from agent: %d bytes", len(data))
+                logger.debug("Total audio written: %d bytes", wav_file.tell() - WAV_HEADER_SIZE)
+                logger.debug("Audio data format: %s...", data[:16].hex())
+
+        async def on_agent_audio_done(self, agent_audio_done, **kwargs):
+            nonlocal wav_file, file_counter, reply_pending
+            print(f"AgentAudioDone event received")
+            print(f"Agent audio done: {agent_audio_done}")
+            if wav_file is not None:
+                data_size = wav_file.tell() - WAV_HEADER_SIZE
+                print(f"Audio size at completion: {data_size} bytes")
+                await asyncio.to_thread(finish_wav, wav_file, data_size)
+                wav_file = None
+                print(f"Created output-{file_counter}.wav")
+            file_counter += 1
+            if reply_pending:
+                reply_pending = False
+                processing_complete.set()
+
+        async def on_user_started_speaking(self, user_started_speaking, **kwargs):
+            nonlocal reply_pending
+            reply_pending = True
+            processing_complete.clear()
+            print(f"User Started Speaking: {user_started_speaking}")
+            write_chatlog(f"User Started Speaking: {user_started_speaking}\n")
+
+        async def on_conversation_text(self, conversation_text, **kwargs):
+            print(f"Conversation Text: {conversation_text}")
+            write_chatlog(f"{_json_encode(vars(conversation_text))}\n")
+
+        async def on_agent_started_speaking(self, agent_started_speaking, **kwargs):
+            # Drop any audio received before this response started
+            if wav_file is not None:
+                await asyncio.to_thread(wav_file.truncate, WAV_HEADER_SIZE)
+                wav_file.seek(WAV_HEADER_SIZE)
+            print(f"Agent Started Speaking: {agent_started_speaking}")
+            write_chatlog(f"Agent Started Speaking: {agent_started_speaking}\n")
+
+        async def on_close(self, close, **kwargs):
+            print(f"Connection closed: {close}")
+            write_chatlog(f"Connection closed: {close}\n")
+            processing_complete.set()
+
+        # Events that are only printed and logged share one generated handler.
+        # The SDK passes each payload as a keyword named after the event.
+        def make_event_logger(label, payload_key, write=write_chatlog):
+            async def handler(self, **kwargs):
+                line = f"{label}: {kwargs[payload_key]}"
+                print(line)
+                write(f"{line}\n")
+            return handler
+
+        logged_events = [
+            (AgentWebSocketEvents.Welcome, "welcome", "Welcome message"),
+            (AgentWebSocketEvents.SettingsApplied, "settings_applied", "Settings applied"),
+            (AgentWebSocketEvents.AgentThinking, "agent_thinking", "Agent Thinking"),
+            (AgentWebSocketEvents.Error, "error", "Error"),
+            (AgentWebSocketEvents.Unhandled, "unhandled", "Unhandled event"),
+        ]
+
+        # Register handlers
+        connection.on(AgentWebSocketEvents.AudioData, on_audio_data)
+        connection.on(AgentWebSocketEvents.AgentAudioDone, on_agent_audio_done)
+        connection.on(AgentWebSocketEvents.ConversationText, on_conversation_text)
+        connection.on(AgentWebSocketEvents.UserStartedSpeaking, on_user_started_speaking)
+        connection.on(AgentWebSocketEvents.AgentStartedSpeaking, on_agent_started_speaking)
+        connection.on(AgentWebSocketEvents.Close, on_close)
+        for event, payload_key, label in logged_events:
+            connection.on(event, make_event_logger(label, payload_key))
+        print("Event handlers registered")
+
+        chatlog_task = asyncio.create_task(chatlog_writer())
+        keep_alive_task = asyncio.create_task(send_keep_alive())
+
+        # Start the connection
+        print("Starting WebSocket connection...")
+        if await connection.start(options) is False:
+            print("Failed to start connection")
+            return
+        print("WebSocket connection started successfully")
+
+        # Stream audio
+        print("Downloading and sending audio...")
+        async with aiohttp.ClientSession() as session:
+            async with session.get(AUDIO_URL) as response:
+                # Skip WAV header
+                header = await response.content.readexactly(44)
+
+                # Verify WAV header
+                if header[0:4] != b'RIFF' or header[8:12] != b'WAVE':
+                    print("Invalid WAV header")
+                    return
+
+                # Extract audio format from header to pace the upload in real time
+                sample_rate = int.from_bytes(header[24:28], 'little')
+                channels = int.from_bytes(header[22:24], 'little')
+                bits_per_sample = int.from_bytes(header[34:36], 'little')
+                byte_rate = sample_rate * channels * (bits_per_sample // 8)
+
+                batch_size = 32768
+                total_bytes_sent = 0
+                chunk_count = 0
+                loop = asyncio.get_running_loop()
+                start_time = loop.time()
+
+                batch = bytearray()
+
+                async def send_batch():
+                    nonlocal total_bytes_sent, chunk_count
+                    logger.debug("Sending chunk %d: %d bytes", chunk_count, len(batch))
+                    await connection.send(bytes(batch))
+                    total_bytes_sent += len(batch)
+                    chunk_count += 1
+                    batch.clear()
+                    # Sleep until the wall clock catches up with the audio sent so far
+                    delay = start_time + total_bytes_sent / byte_rate - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                # iter_chunked yields whatever is buffered (up to batch_size), so
+                # accumulate full batches before each send
+                async for chunk in response.content.iter_chunked(batch_size):
+                    batch.extend(chunk)
+                    if len(batch) >= batch_size:
+                        await send_batch()
+                if batch:
+                    await send_batch()
+
+        print(f"Total audio data sent: {total_bytes_sent} bytes in {chunk_count} chunks")
+
+        # Wait for processing
+        print("Waiting for processing to complete...")
+        timeout = 60  # 60 second timeout
+
+        try:
+            await asyncio.wait_for(processing_complete.wait(), timeout=timeout)
+            print("Processing complete. Check output-*.wav and chatlog.txt for results.")
+        except asyncio.TimeoutError:
+            print(f"Processing timed out after {timeout} seconds")
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+    finally:
+        # Finish the connection first, on the error path too, so no audio
+        # handler is still running when the WAV file is finished below
+        if connection is not None:
+            await connection.finish()
+            print("Finished")
+        if keep_alive_task is not None:
+            keep_alive_task.cancel()
+            await asyncio.gather(keep_alive_task, return_exceptions=True)
+        # Stop the chat log writer rather than cancelling it: cancelling would
+        # abandon a to_thread os.write that could then land on a closed fd
+        chatlog_stop.set()
+        chatlog_wake.set()
+        if chatlog_task is not None:
+            await chatlog_task
+        if chatlog_fd is not None:
+            os.close(chatlog_fd)
+        # Patch the sizes of an utterance cut short so the file stays playable
+        if wav_file is not None:
+            await asyncio.to_thread(finish_wav, wav_file, wav_file.tell() - WAV_HEADER_SIZE)
+
+# WAV Header Functions
+WAV_HEADER_SIZE = 44
+
+def finish_wav(wav_file, data_size):
+    """Patch the RIFF and data chunk sizes of a streamed WAV file and close it"""
+    wav_file.seek(4)
+    wav_file.write(struct.pack("<I", 36 + data_size))
+    wav_file.seek(40)
+    wav_file.write(struct.pack("<I", data_size))
+    wav_file.close()
+
+@functools.lru_cache(maxsize=8)
+def create_wav_header(sample_rate=24000, bits_per_sample=16, channels=1):
+    """Create a WAV header with the specified parameters (cached, returns immutable bytes)"""
+    byte_rate = sample_rate * channels * (bits_per_sample // 8)
+    block_align = channels * (bits_per_sample // 8)
+
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF',
+        0,  # File size (to be updated later)
+        b'WAVE',
+        b'fmt ',
+        16,  # Subchunk1Size (16 for PCM)
+        1,  # AudioFormat (1 for PCM)
+        channels,  # NumChannels
+        sample_rate,  # SampleRate
+        byte_rate,  # ByteRate
+        block_align,  # BlockAlign
+        bits_per_sample,  # BitsPerSample
+        b'data',
+        0,  # Subchunk2Size (to be updated later)
+    )
+
+if __name__ == "__main__":
+    # Per-chunk audio and keep-alive messages are logged at DEBUG. Only this
+    # module's logger is configured; the SDK's loggers have their own handlers.
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    asyncio.run(main())
@@ -4,11 +4,15 @@
 
 # Import dependencies and set up the main function
 import requests
+import collections
 import wave
 import io
+import functools
 import time
 import os
 import json
+import logging
+import struct
 import threading
 from datetime import datetime
 
@@ -20,7 +24,20 @@ from deepgram import (
 )
 from deepgram.clients.agent.v1.websocket.options import SettingsOptions
 
+logger = logging.getLogger(__name__)
+
+# Shared compact JSON encoder for chat log entries
+_json_encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
 def main():
+    connection = None
+    chatlog_fd = None
+    wav_file = None
+    keep_alive_stop = threading.Event()
+    keep_alive_thread = None
+    chatlog_wake = threading.Event()
+    chatlog_stop = threading.Event()
+    chatlog_thread = None
     try:
         # Initialize the Voice Agent
         api_key = os.getenv("DEEPGRAM_API_KEY")
@@ -59,102 +76,148 @@ def main():
         options.agent.speak.provider.model = "aura-2-thalia-en"
         options.agent.greeting = "Hello! How can I help you today?"
 
-        # Send Keep Alive messages
+        # Send Keep Alive messages every 5 seconds until asked to stop. The message
+        # is serialized once; it stays a str so it goes out as a text frame.
+        keep_alive_message = str(AgentKeepAlive())
+
         def send_keep_alive():
-            while True:
-                time.sleep(5)
-                print("Keep alive!")
-                connection.send(str(AgentKeepAlive()))
+            next_tick = time.monotonic() + 5
+            while not keep_alive_stop.wait(max(0, next_tick - time.monotonic())):
+                # Skip ticks missed during a stall so it costs at most one catch-up send
+                now = time.monotonic()
+                while next_tick <= now:
+                    next_tick += 5
+                if not connection.is_connected():
+                    continue
+                logger.debug("Keep alive!")
+                if not connection.send(keep_alive_message):
+                    logger.debug("Keep alive send failed, retrying on the next tick")
 
         # Start keep-alive in a separate thread
         keep_alive_thread = threading.Thread(target=send_keep_alive, daemon=True)
         keep_alive_thread.start()
 
+        # Open the chat log once in append mode. Handlers queue lines for a
+        # dedicated writer thread so disk latency never blocks the WebSocket
+        # receive path. The queue drops the oldest lines if the writer falls behind.
+        chatlog_fd = os.open("chatlog.txt", os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        chatlog_queue = collections.deque(maxlen=1024)
+
+        def write_chatlog(line):
+            chatlog_queue.append(line)
+            chatlog_wake.set()
+
+        def drain_chatlog():
+            # Coalesce everything queued so far into a single append
+            lines = []
+            while chatlog_queue:
+                lines.append(chatlog_queue.popleft())
+            if lines:
+                os.write(chatlog_fd, "".join(lines).encode("utf-8"))
+
+        def chatlog_writer():
+            while not chatlog_stop.is_set():
+                chatlog_wake.wait()
+                chatlog_wake.clear()
+                drain_chatlog()
+            drain_chatlog()
+
+        chatlog_thread = threading.Thread(target=chatlog_writer, daemon=True)
+        chatlog_thread.start()
+
         # Setup Event Handlers
-        audio_buffer = bytearray()
         file_counter = 0
-        processing_complete = False
-
+        # processing_complete is only set by an AgentAudioDone that answers
+        # something the user said, so the greeting does not count as a reply.
+        processing_complete = threading.Event()
+        reply_pending = False
+
+        # Agent audio is streamed straight into output-N.wav as it arrives, so
+        # memory use stays flat however long the response is. The file is
+        # opened on the first chunk with a placeholder header whose sizes are
+        # patched in once the agent is done speaking. This write happens on the
+        # WebSocket receive thread, unlike the chat log; a 1 MiB buffer keeps
+        # most chunks to a memcpy, but a slow disk can still stall receiving.
         def on_audio_data(self, data, **kwargs):
-            nonlocal audio_buffer
-            audio_buffer.extend(data)
-            print(f"Received audio data from agent: {len(data)} bytes")
-            print(f"Total buffer size: {len(audio_buffer)} bytes")
-            print(f"Audio data format: {data[:16].hex()}...")
+            nonlocal wav_file
+            # Convert anything that isn't already a bytes-like buffer once, so
+            # the file write below always takes the buffer-protocol fast path
+            if not isinstance(data, (bytes, bytearray, memoryview)):
+                data = bytes(data)
+            if wav_file is None:
+                wav_file = open(f"output-{file_counter}.wav", 'wb', buffering=1 << 20)
+                wav_file.write(create_wav_header())
+            wav_file.write(data)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received audio data from agent: %d bytes", len(data))
+                logger.debug("Total audio written: %d bytes", wav_file.tell() - WAV_HEADER_SIZE)
+                logger.debug("Audio data format: %s...", data[:16].hex())
 
         def on_agent_audio_done(self, agent_audio_done, **kwargs):
-            nonlocal audio_buffer, file_counter, processing_complete
+            nonlocal wav_file, file_counter, reply_pending
             print(f"AgentAudioDone event received")
-            print(f"Buffer size at completion: {len(audio_buffer)} bytes")
             print(f"Agent audio done: {agent_audio_done}")
-            if len(audio_buffer) > 0:
-                with open(f"output-{file_counter}.wav", 'wb') as f:
-                    f.write(create_wav_header())
-                    f.write(audio_buffer)
+            if wav_file is not None:
+                data_size = wav_file.tell() - WAV_HEADER_SIZE
+                print(f"Audio size at completion: {data_size} bytes")
+                finish_wav(wav_file, data_size)
+                wav_file = None
                 print(f"Created output-{file_counter}.wav")
-            audio_buffer = bytearray()
             file_counter += 1
-            processing_complete = True
-
-        def on_conversation_text(self, conversation_text, **kwargs):
-            print(f"Conversation Text: {conversation_text}")
-            with open("chatlog.txt", 'a') as chatlog:
-                chatlog.write(f"{json.dumps(conversation_text.__dict__)}\n")
-
-        def on_welcome(self, welcome, **kwargs):
-            print(f"Welcome message received: {welcome}")
-            with open("chatlog.txt", 'a') as chatlog:
-                chatlog.write(f"Welcome message: {welcome}\n")
-
-        def on_settings_applied(self, settings_applied, **kwargs):
-            print(f"Settings applied: {settings_applied}")
-            with open("chatlog.txt", 'a') as chatlog:
-                chatlog.write(f"Settings applied: {settings_applied}\n")
+            if reply_pending:
+                reply_pending = False
+                processing_complete.set()
 
         def on_user_started_speaking(self, user_started_speaking, **kwargs):
+            nonlocal reply_pending
+            reply_pending = True
+            processing_complete.clear()
             print(f"User Started Speaking: {user_started_speaking}")
-            with open("chatlog.txt", 'a') as chatlog:
-                chatlog.write(f"User Started Speaking: {user_started_speaking}\n")
+            write_chatlog(f"User Started Speaking: {user_started_speaking}\n")
 
-        def on_agent_thinking(self, agent_thinking, **kwargs):
-            print(f"Agent Thinking: {agent_thinking}")
-            with open("chatlog.txt", 'a') as chatlog:
-                chatlog.write(f"Agent Thinking: {agent_thinking}\n")
+        def on_conversation_text(self, conversation_text, **kwargs):
+            print(f"Conversation Text: {conversation_text}")
+            write_chatlog(f"{_json_encode(vars(conversation_text))}\n")
 
         def on_agent_started_speaking(self, agent_started_speaking, **kwargs):
-            nonlocal audio_buffer
-            audio_buffer = bytearray()  # Reset buffer for new response
+            # Drop any audio received before this response started
+            if wav_file is not None:
+                wav_file.seek(WAV_HEADER_SIZE)
+                wav_file.truncate()
             print(f"Agent Started Speaking: {agent_started_speaking}")
-            with open("chatlog.txt", 'a') as chatlog:
-                chatlog.write(f"Agent Started Speaking: {agent_started_speaking}\n")
+            write_chatlog(f"Agent Started Speaking: {agent_started_speaking}\n")
 
         def on_close(self, close, **kwargs):
             print(f"Connection closed: {close}")
-            with open("chatlog.txt", 'a') as chatlog:
-                chatlog.write(f"Connection closed: {close}\n")
-
-        def on_error(self, error, **kwargs):
-            print(f"Error: {error}")
-            with open("chatlog.txt", 'a') as chatlog:
-                chatlog.write(f"Error: {error}\n")
-
-        def on_unhandled(self, unhandled, **kwargs):
-            print(f"Unhandled event: {unhandled}")
-            with open("chatlog.txt", 'a') as chatlog:
-                chatlog.write(f"Unhandled event: {unhandled}\n")
+            write_chatlog(f"Connection closed: {close}\n")
+            processing_complete.set()
+
+        # Events that are only printed and logged share one generated handler.
+        # The SDK passes each payload as a keyword named after the event.
+        def make_event_logger(label, payload_key, write=write_chatlog):
+            def handler(self, **kwargs):
+                line = f"{label}: {kwargs[payload_key]}"
+                print(line)
+                write(f"{line}\n")
+            return handler
+
+        logged_events = [
+            (AgentWebSocketEvents.Welcome, "welcome", "Welcome message"),
+            (AgentWebSocketEvents.SettingsApplied, "settings_applied", "Settings applied"),
+            (AgentWebSocketEvents.AgentThinking, "agent_thinking", "Agent Thinking"),
+            (AgentWebSocketEvents.Error, "error", "Error"),
+            (AgentWebSocketEvents.Unhandled, "unhandled", "Unhandled event"),
+        ]
 
         # Register handlers
         connection.on(AgentWebSocketEvents.AudioData, on_audio_data)
         connection.on(AgentWebSocketEvents.AgentAudioDone, on_agent_audio_done)
         connection.on(AgentWebSocketEvents.ConversationText, on_conversation_text)
-        connection.on(AgentWebSocketEvents.Welcome, on_welcome)
-        connection.on(AgentWebSocketEvents.SettingsApplied, on_settings_applied)
         connection.on(AgentWebSocketEvents.UserStartedSpeaking, on_user_started_speaking)
-        connection.on(AgentWebSocketEvents.AgentThinking, on_agent_thinking)
         connection.on(AgentWebSocketEvents.AgentStartedSpeaking, on_agent_started_speaking)
         connection.on(AgentWebSocketEvents.Close, on_close)
-        connection.on(AgentWebSocketEvents.Error, on_error)
-        connection.on(AgentWebSocketEvents.Unhandled, on_unhandled)
+        for event, payload_key, label in logged_events:
+            connection.on(event, make_event_logger(label, payload_key))
         print("Event handlers registered")
 
         # Start the connection
@@ -178,66 +241,100 @@ def main():
         # Extract sample rate from header
         sample_rate = int.from_bytes(header[24:28], 'little')
 
-        chunk_size = 8192
+        # Send 32 KiB frames (iter_content yields full reads of chunk_size)
+        # and pace them by audio duration
+        channels = int.from_bytes(header[22:24], 'little')
+        bits_per_sample = int.from_bytes(header[34:36], 'little')
+        byte_rate = sample_rate * channels * (bits_per_sample // 8)
+        chunk_size = 32768
         total_bytes_sent = 0
         chunk_count = 0
+        start_time = time.monotonic()
         for chunk in response.iter_content(chunk_size=chunk_size):
             if chunk:
-                print(f"Sending chunk {chunk_count}: {len(chunk)} bytes")
+                logger.debug("Sending chunk %d: %d bytes", chunk_count, len(chunk))
                 connection.send(chunk)
                 total_bytes_sent += len(chunk)
                 chunk_count += 1
-                time.sleep(0.1)  # Small delay between chunks
+                # Sleep until the wall clock catches up with the audio sent so far
+                delay = start_time + total_bytes_sent / byte_rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
 
         print(f"Total audio data sent: {total_bytes_sent} bytes in {chunk_count} chunks")
         print("Waiting for agent response...")
 
         # Wait for processing
         print("Waiting for processing to complete...")
-        start_time = time.time()
-        timeout = 30  # 30 second timeout
+        timeout = 60  # 60 second timeout
 
-        while not processing_complete and (time.time() - start_time) < timeout:
-            time.sleep(1)
-            print(f"Still waiting for agent response... ({int(time.time() - start_time)}s elapsed)")
-
-        if not processing_complete:
-            print("Processing timed out after 30 seconds")
+        if not processing_complete.wait(timeout=timeout):
+            print(f"Processing timed out after {timeout} seconds")
         else:
             print("Processing complete. Check output-*.wav and chatlog.txt for results.")
 
-        # Cleanup
-        connection.finish()
-        print("Finished")
-
     except Exception as e:
         print(f"Error: {str(e)}")
+    finally:
+        # Finish the connection first, on the error path too, so no audio
+        # handler is still running when the WAV file is finished below
+        if connection is not None:
+            connection.finish()
+            print("Finished")
+        keep_alive_stop.set()
+        if keep_alive_thread is not None:
+            keep_alive_thread.join(timeout=1)
+        chatlog_stop.set()
+        chatlog_wake.set()
+        # The writer always exits once chatlog_stop is set; wait for it so no
+        # os.write can land on the descriptor after it is closed
+        if chatlog_thread is not None:
+            chatlog_thread.join()
+        if chatlog_fd is not None:
+            os.close(chatlog_fd)
+        # Patch the sizes of an utterance cut short so the file stays playable
+        if wav_file is not None:
+            finish_wav(wav_file, wav_file.tell() - WAV_HEADER_SIZE)
 
 # WAV Header Functions
+WAV_HEADER_SIZE = 44
+
+def finish_wav(wav_file, data_size):
+    """Patch the RIFF and data chunk sizes of a streamed WAV file and close it"""
+    wav_file.seek(4)
+    wav_file.write(struct.pack("<I", 36 + data_size))
+    wav_file.seek(40)
+    wav_file.write(struct.pack("<I", data_size))
+    wav_file.close()
+
+@functools.lru_cache(maxsize=8)
 def create_wav_header(sample_rate=24000, bits_per_sample=16, channels=1):
-    """Create a WAV header with the specified parameters"""
+    """Create a WAV header with the specified parameters (cached, returns immutable bytes)"""
     byte_rate = sample_rate * channels * (bits_per_sample // 8)
     block_align = channels * (bits_per_sample // 8)
 
-    header = bytearray(44)
-    # RIFF header
-    header[0:4] = b'RIFF'
-    header[4:8] = b'\x00\x00\x00\x00'  # File size (to be updated later)
-    header[8:12] = b'WAVE'
-    # fmt chunk
-    header[12:16] = b'fmt '
-    header[16:20] = b'\x10\x00\x00\x00'  # Subchunk1Size (16 for PCM)
-    header[20:22] = b'\x01\x00'  # AudioFormat (1 for PCM)
-    header[22:24] = channels.to_bytes(2, 'little')  # NumChannels
-    header[24:28] = sample_rate.to_bytes(4, 'little')  # SampleRate
-    header[28:32] = byte_rate.to_bytes(4, 'little')  # ByteRate
-    header[32:34] = block_align.to_bytes(2, 'little')  # BlockAlign
-    header[34:36] = bits_per_sample.to_bytes(2, 'little')  # BitsPerSample
-    # data chunk
-    header[36:40] = b'data'
-    header[40:44] = b'\x00\x00\x00\x00'  # Subchunk2Size (to be updated later)
-
-    return header
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF',
+        0,  # File size (to be updated later)
+        b'WAVE',
+        b'fmt ',
+        16,  # Subchunk1Size (16 for PCM)
+        1,  # AudioFormat (1 for PCM)
+        channels,  # NumChannels
+        sample_rate,  # SampleRate
+        byte_rate,  # ByteRate
+        block_align,  # BlockAlign
+        bits_per_sample,  # BitsPerSample
+        b'data',
+        0,  # Subchunk2Size (to be updated later)
+    )
 
 if __name__ == "__main__":
+    # Per-chunk audio and keep-alive messages are logged at DEBUG. Only this
+    # module's logger is configured; the SDK's loggers have their own handlers.
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
     main()